@@ -1,18 +1,22 @@
 from __future__ import annotations
 
 import asyncio
-import json
+import copy
+import functools
 import logging
-import math
+import re
+import string
+from collections.abc import Callable
 from datetime import UTC, datetime
 from pathlib import Path
 from typing import Any
 
 import httpx
+import orjson
 from tenacity import retry, stop_after_attempt, wait_exponential_jitter
 
 from bitpeer.common.config import AppConfig, MarketConfig
-from bitpeer.models import RawFetchRecord
+from bitpeer.models import RawFetchRecord, response_body_hash
 from bitpeer.storage.raw import RawStore
 
 log = logging.getLogger(__name__)
@@ -28,6 +32,9 @@ _SENSITIVE_HEADERS = {
 }
 
 
+_RESULT_COUNT_RE = re.compile(r'"result"\s*:\s*\{\s*"count"\s*:\s*"?(\d+)')
+
+
 def _sanitize_headers(headers: dict[str, str]) -> dict[str, str]:
     return {k: v for k, v in headers.items() if k.lower() not in _SENSITIVE_HEADERS}
 
@@ -52,6 +59,111 @@ def _build_body(
     return _substitute_placeholders(template, ctx)
 
 
+# page -> request body, specialized for one market.
+BodyBuilder = Callable[[int], dict[str, Any]]
+
+_FORMATTER = string.Formatter()
+# Matches a format field whose root name is `page` (`page`, `page.real`, `page[0]`).
+_ROOT_FIELD_RE = re.compile(r"page(?:$|[.\[])")
+
+
+def _uses_page(value: str) -> bool:
+    try:
+        parsed = list(_FORMATTER.parse(value))
+    except ValueError:
+        return False
+    return any(field is not None and _ROOT_FIELD_RE.match(field) for _, field, _, _ in parsed)
+
+
+def _compile_page_format(value: str, ctx: dict[str, Any]) -> Callable[[int], str] | None:
+    """
+    Precompile a template string that references `{page}`: static placeholders are filled
+    in now, leaving the literal pieces between page occurrences so a call is one join.
+    Returns None if the string would not format at all; it is then sent as-is, like
+    `_substitute_placeholders` does.
+    """
+
+    try:
+        value.format(**ctx, page=0)
+    except Exception:  # noqa: BLE001
+        return None
+
+    pieces: list[str] = []
+    current: list[str] = []
+    for literal, field, spec, conversion in _FORMATTER.parse(value):
+        current.append(literal)
+        if field is None:
+            continue
+        if spec or conversion or field not in (*ctx, "page"):
+            # Format specs, conversions or attribute/index access: keep the general path.
+            return lambda page: value.format(**ctx, page=page)
+        if field == "page":
+            pieces.append("".join(current))
+            current = []
+        else:
+            current.append(format(ctx[field]))
+    pieces.append("".join(current))
+    return lambda page: str(page).join(pieces)
+
+
+def _set_path(root: Any, path: tuple[Any, ...], value: Any) -> None:
+    # Copy each container on the way down so the shared skeleton is never mutated.
+    node = root
+    for key in path[:-1]:
+        child = copy.copy(node[key])
+        node[key] = child
+        node = child
+    node[path[-1]] = value
+
+
+def _compile_body_builder(
+    template: dict[str, Any], *, fiat: str, side: str, endpoint_side: str
+) -> BodyBuilder:
+    """
+    Specialize `template` for one market: everything that does not depend on `page`
+    is substituted once, and each call only runs the precompiled `{page}` strings.
+    Bodies are memoized per page, so callers must treat them as read-only.
+    """
+
+    ctx: dict[str, Any] = {"fiat": fiat, "side": side, "endpoint_side": endpoint_side}
+    page_paths: list[tuple[tuple[Any, ...], Callable[[int], str]]] = []
+
+    def walk(value: Any, path: tuple[Any, ...]) -> Any:
+        if isinstance(value, str):
+            if _uses_page(value):
+                fmt = _compile_page_format(value, ctx)
+                if fmt is not None:
+                    page_paths.append((path, fmt))
+                return value
+            return _substitute_placeholders(value, ctx)
+        if isinstance(value, list):
+            return [walk(v, (*path, i)) for i, v in enumerate(value)]
+        if isinstance(value, dict):
+            return {k: walk(v, (*path, k)) for k, v in value.items()}
+        return value
+
+    skeleton: dict[str, Any] = walk(template, ())
+
+    @functools.lru_cache(maxsize=256)
+    def build(page: int) -> dict[str, Any]:
+        body = copy.copy(skeleton)
+        for path, fmt in page_paths:
+            _set_path(body, path, fmt(page))
+        return body
+
+    return build
+
+
+def _compile_body_builders(cfg: AppConfig) -> dict[str, BodyBuilder]:
+    template = cfg.bybit_p2p_endpoint.body_template
+    return {
+        m.name: _compile_body_builder(
+            template, fiat=m.fiat, side=m.side, endpoint_side=m.endpoint_side
+        )
+        for m in cfg.markets
+    }
+
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential_jitter(initial=1, max=10), reraise=True)
 async def _request(
     client: httpx.AsyncClient,
@@ -67,17 +179,25 @@ async def _request(
 
 
 async def fetch_market_page(
-    client: httpx.AsyncClient, cfg: AppConfig, market: MarketConfig, page: int
+    client: httpx.AsyncClient,
+    cfg: AppConfig,
+    market: MarketConfig,
+    page: int,
+    *,
+    build_body: BodyBuilder | None = None,
 ) -> RawFetchRecord:
     endpoint = cfg.bybit_p2p_endpoint
     request_headers = dict(endpoint.headers)
-    request_body = _build_body(
-        endpoint.body_template,
-        fiat=market.fiat,
-        side=market.side,
-        endpoint_side=market.endpoint_side,
-        page=page,
-    )
+    if build_body is not None:
+        request_body = build_body(page)
+    else:
+        request_body = _build_body(
+            endpoint.body_template,
+            fiat=market.fiat,
+            side=market.side,
+            endpoint_side=market.endpoint_side,
+            page=page,
+        )
 
     ts = datetime.now(UTC)
     try:
@@ -108,55 +228,101 @@ async def fetch_market_page(
         request_body=request_body,
         http_status=status,
         response_text=text,
+        body_hash=response_body_hash(text) if text is not None else None,
         error=err,
     )
 
 
-async def collect_once(cfg: AppConfig, store: RawStore) -> None:
+def _make_client(cfg: AppConfig) -> httpx.AsyncClient:
+    # One long-lived HTTP/2 client: pages multiplex over a single connection and
+    # TLS handshakes are not repeated every cycle.
     endpoint = cfg.bybit_p2p_endpoint
-    timeout = httpx.Timeout(timeout=endpoint.timeout_seconds)
-
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        for market in cfg.markets:
-            first = await fetch_market_page(client, cfg, market, page=1)
-            _log_and_store(store, first)
-
-            total_pages = _derive_total_pages(first)
-            # `max_pages <= 0` means "no manual limit", but still keep a safety cap.
-            safety_cap = 200
-            if cfg.collector.max_pages > 0:
-                pages_to_fetch = min(total_pages, cfg.collector.max_pages, safety_cap)
-            else:
-                pages_to_fetch = min(total_pages, safety_cap)
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(timeout=endpoint.timeout_seconds),
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60),
+    )
 
-            if pages_to_fetch <= 1:
-                continue
 
-            tasks: list[asyncio.Task[RawFetchRecord]] = []
-            for page in range(2, pages_to_fetch + 1):
-                tasks.append(asyncio.create_task(fetch_market_page(client, cfg, market, page)))
+async def _collect_market(
+    client: httpx.AsyncClient,
+    cfg: AppConfig,
+    market: MarketConfig,
+    store: RawStore,
+    sem: asyncio.Semaphore,
+    build_body: BodyBuilder,
+) -> None:
+    first = await fetch_market_page(client, cfg, market, page=1, build_body=build_body)
+    _log_and_store(store, first)
+
+    total_pages = _derive_total_pages(first)
+    # `max_pages <= 0` means "no manual limit", but still keep a safety cap.
+    safety_cap = 200
+    if cfg.collector.max_pages > 0:
+        pages_to_fetch = min(total_pages, cfg.collector.max_pages, safety_cap)
+    else:
+        pages_to_fetch = min(total_pages, safety_cap)
+
+    if pages_to_fetch <= 1:
+        return
+
+    async def fetch_page(page: int) -> RawFetchRecord:
+        async with sem:
+            return await fetch_market_page(client, cfg, market, page, build_body=build_body)
+
+    results = await asyncio.gather(*(fetch_page(p) for p in range(2, pages_to_fetch + 1)))
+    for rec in results:
+        _log_and_store(store, rec)
+
+
+async def collect_once(
+    cfg: AppConfig,
+    store: RawStore,
+    client: httpx.AsyncClient,
+    bodies: dict[str, BodyBuilder] | None = None,
+) -> None:
+    if bodies is None:
+        bodies = _compile_body_builders(cfg)
+
+    # Markets run concurrently. `_log_and_store` never awaits, so writes cannot
+    # interleave on the event loop, and each market appends to its own file.
+    # The semaphore bounds in-flight page requests across all markets.
+    sem = asyncio.Semaphore(max(cfg.collector.max_concurrent_pages, 1))
+    await asyncio.gather(
+        *(
+            _collect_market(client, cfg, market, store, sem, bodies[market.name])
+            for market in cfg.markets
+        )
+    )
 
-            for task in asyncio.as_completed(tasks):
-                rec = await task
-                _log_and_store(store, rec)
 
+def _total_count(response_text: str) -> int | None:
+    # Bybit puts `count` first in `result`, so a regex usually finds it without decoding
+    # the page; anything else falls back to a full decode.
+    m = _RESULT_COUNT_RE.search(response_text)
+    if m is not None:
+        return int(m.group(1))
 
-def _derive_total_pages(record: RawFetchRecord) -> int:
-    if not record.response_text:
-        return 1
     try:
-        payload = json.loads(record.response_text)
+        payload = orjson.loads(response_text)
     except Exception:  # noqa: BLE001
-        return 1
+        return None
 
     result = payload.get("result") if isinstance(payload, dict) else None
     if not isinstance(result, dict):
-        return 1
+        return None
 
-    count_raw = result.get("count")
     try:
-        total_count = int(count_raw)
+        return int(result.get("count"))
     except Exception:  # noqa: BLE001
+        return None
+
+
+def _derive_total_pages(record: RawFetchRecord) -> int:
+    if not record.response_text:
+        return 1
+    total_count = _total_count(record.response_text)
+    if total_count is None:
         return 1
 
     # Request body keeps size as a string in our endpoint template.
@@ -166,7 +332,7 @@ def _derive_total_pages(record: RawFetchRecord) -> int:
     except Exception:  # noqa: BLE001
         page_size = 10
 
-    return max(1, math.ceil(total_count / page_size))
+    return max(1, -(-total_count // page_size))
 
 
 def _log_and_store(store: RawStore, rec: RawFetchRecord) -> None:
@@ -185,14 +351,16 @@ def _log_and_store(store: RawStore, rec: RawFetchRecord) -> None:
 
 async def collect_forever(cfg: AppConfig, *, once: bool = False) -> None:
     store = RawStore(data_dir=Path(cfg.app.data_dir))
+    bodies = _compile_body_builders(cfg)
 
-    while True:
-        started = datetime.now(UTC)
-        await collect_once(cfg, store)
+    async with _make_client(cfg) as client:
+        while True:
+            started = datetime.now(UTC)
+            await collect_once(cfg, store, client, bodies)
 
-        if once:
-            return
+            if once:
+                return
 
-        elapsed = (datetime.now(UTC) - started).total_seconds()
-        sleep_s = max(0.0, cfg.collector.interval_seconds - elapsed)
-        await asyncio.sleep(sleep_s)
+            elapsed = (datetime.now(UTC) - started).total_seconds()
+            sleep_s = max(0.0, cfg.collector.interval_seconds - elapsed)
+            await asyncio.sleep(sleep_s)
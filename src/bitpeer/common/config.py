@@ -29,6 +29,7 @@ class MarketConfig(BaseModel):
 class CollectorConfig(BaseModel):
     interval_seconds: int = 30
     max_pages: int = 5
+    max_concurrent_pages: int = 8
     min_offers_after_filter: int = 30
 
 
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Literal, Optional
 
 import polars as pl
 
@@ -23,9 +23,15 @@ def _list_days(data_dir: Path) -> list[str]:
     return sorted([p.stem for p in offers_dir.glob("*.parquet")])
 
 
-def _load_offers(data_dir: Path, *, day: str) -> pl.DataFrame:
+def _load_offers(data_dir: Path, *, day: str) -> pl.LazyFrame:
     path = data_dir / "processed" / "offers" / f"{day}.parquet"
-    return pl.read_parquet(path)
+    return pl.scan_parquet(path)
+
+
+def _offers_version(data_dir: Path, *, day: str) -> int:
+    # Part of the cache key, so re-processing a day invalidates cached results.
+    path = data_dir / "processed" / "offers" / f"{day}.parquet"
+    return path.stat().st_mtime_ns
 
 
 def _as_number(v: Optional[float], *, default: float) -> float:
@@ -35,11 +41,101 @@ def _as_number(v: Optional[float], *, default: float) -> float:
         return default
 
 
+def _methods_for(data_dir: Path, day: str, version: int, fiat: str) -> list[str]:
+    """
+    Sorted distinct payment methods seen for `fiat` on `day`.
+    `version` is only part of the cache key.
+    """
+
+    return (
+        _load_offers(data_dir, day=day)
+        .filter(pl.col("fiat") == fiat)
+        .select(pl.col("payment_methods").explode().drop_nulls().unique().sort())
+        .collect()
+        .to_series()
+        .to_list()
+    )
+
+
+@dataclass(frozen=True)
+class LegQuery:
+    fiat: str
+    side: Literal["BUY", "SELL"]
+    # Fiat amount, or USDT amount (converted at each offer's price) if `amount_in_usdt`.
+    amount: float
+    amount_in_usdt: bool
+    merchant_only: bool
+    min_rating: float
+    methods: tuple[str, ...]
+
+    @property
+    def best_is_max(self) -> bool:
+        # Selling USDT to BUY-side offers: the highest price is best.
+        return self.side == "BUY"
+
+
+def _payment_filter_expr(selected: list[str]) -> pl.Expr:
+    if not selected:
+        return pl.lit(True)
+    # Any overlap between offer.payment_methods and selected list.
+    selected_lit = pl.lit(selected, dtype=pl.List(pl.Utf8))
+    return pl.col("payment_methods").list.set_intersection(selected_lit).list.len() > 0
+
+
+def _leg_offers(data_dir: Path, day: str, q: LegQuery) -> pl.LazyFrame:
+    lf = _load_offers(data_dir, day=day)
+    lf = lf.filter((pl.col("fiat") == q.fiat) & (pl.col("side") == q.side))
+    if q.merchant_only:
+        lf = lf.filter(pl.col("is_merchant") == True)  # noqa: E712
+    if q.min_rating > 0:
+        lf = lf.filter(pl.col("rating").is_null() | (pl.col("rating") >= q.min_rating))
+    fiat_amount = q.amount * pl.col("price_fiat_per_usdt") if q.amount_in_usdt else pl.lit(q.amount)
+    lf = lf.filter((pl.col("min_fiat") <= fiat_amount) & (fiat_amount <= pl.col("max_fiat")))
+    return lf.filter(_payment_filter_expr(list(q.methods)))
+
+
+def _leg_snapshot(data_dir: Path, day: str, version: int, q: LegQuery) -> pl.DataFrame:
+    """
+    Top offers of the latest snapshot for one leg, best first; empty if nothing is executable.
+    `version` is only part of the cache key.
+    """
+
+    return (
+        _leg_offers(data_dir, day, q)
+        .filter(pl.col("ts_utc") == pl.col("ts_utc").max())
+        .sort("price_fiat_per_usdt", descending=q.best_is_max)
+        .head(20)
+        .collect()
+    )
+
+
+def _leg_history(
+    data_dir: Path, day: str, version: int, q: LegQuery, *, alias: str
+) -> pl.DataFrame:
+    """
+    Best single price per snapshot for one leg. `version` is only part of the cache key.
+    """
+
+    price = pl.col("price_fiat_per_usdt")
+    best = price.max() if q.best_is_max else price.min()
+    return (
+        _leg_offers(data_dir, day, q)
+        .group_by("ts_utc")
+        .agg(best.alias(alias))
+        .sort("ts_utc")
+        .collect()
+    )
+
+
 def main() -> None:
     import streamlit as st
 
     st.set_page_config(page_title="bitpeer — Bybit P2P", layout="wide")
 
+    methods_for = st.cache_data(max_entries=64)(_methods_for)
+    leg_snapshot = st.cache_data(max_entries=64)(_leg_snapshot)
+    leg_history = st.cache_data(max_entries=64)(_leg_history)
+
     data_dir = st.sidebar.text_input("Data dir", value=str(_default_data_dir()))
     state = UiState(data_dir=Path(data_dir))
 
@@ -51,7 +147,7 @@ def main() -> None:
         return
 
     day = st.sidebar.selectbox("Day (UTC)", options=days, index=len(days) - 1)
-    df = _load_offers(state.data_dir, day=day)
+    version = _offers_version(state.data_dir, day=day)
 
     st.sidebar.markdown("### Inputs")
     buy_amount_rub = st.sidebar.number_input("buy_amount_rub", min_value=1.0, value=50_000.0, step=1000.0)
@@ -59,105 +155,69 @@ def main() -> None:
     merchant_only = st.sidebar.checkbox("merchant_only", value=False)
     min_rating = st.sidebar.number_input("min_rating", min_value=0.0, value=0.0, step=0.1)
 
-    def payment_filter_expr(selected: list[str]) -> pl.Expr:
-        if not selected:
-            return pl.lit(True)
-        # Any overlap between offer.payment_methods and selected list.
-        return pl.col("payment_methods").list.eval(pl.element().is_in(selected)).list.any()
-
     st.sidebar.markdown("### Payment filters")
-    rub_methods_all = (
-        df.filter(pl.col("fiat") == "RUB")
-        .select(pl.col("payment_methods").explode())
-        .drop_nulls()
-        .unique()
-        .sort("payment_methods")
-        .to_series()
-        .to_list()
-    )
-    vnd_methods_all = (
-        df.filter(pl.col("fiat") == "VND")
-        .select(pl.col("payment_methods").explode())
-        .drop_nulls()
-        .unique()
-        .sort("payment_methods")
-        .to_series()
-        .to_list()
-    )
+    rub_methods_all = methods_for(state.data_dir, day, version, "RUB")
+    vnd_methods_all = methods_for(state.data_dir, day, version, "VND")
     rub_methods = st.sidebar.multiselect("RUB leg methods", options=rub_methods_all, default=[])
     vnd_methods = st.sidebar.multiselect("VND leg methods", options=vnd_methods_all, default=[])
 
-    base = df
-    if merchant_only:
-        base = base.filter(pl.col("is_merchant") == True)  # noqa: E712
-    if min_rating > 0:
-        base = base.filter(pl.col("rating").is_null() | (pl.col("rating") >= min_rating))
+    rub_leg = LegQuery(
+        fiat="RUB",
+        side="SELL",
+        amount=buy_amount_rub,
+        amount_in_usdt=False,
+        merchant_only=merchant_only,
+        min_rating=min_rating,
+        methods=tuple(rub_methods),
+    )
+    vnd_leg = LegQuery(
+        fiat="VND",
+        side="BUY",
+        amount=sell_amount_usdt,
+        amount_in_usdt=True,
+        merchant_only=merchant_only,
+        min_rating=min_rating,
+        methods=tuple(vnd_methods),
+    )
 
     col_buy, col_sell = st.columns(2)
 
     with col_buy:
         st.subheader("Buy USDT with RUB (fiat=RUB, side=SELL)")
-        leg = base.filter((pl.col("fiat") == "RUB") & (pl.col("side") == "SELL"))
-        leg = leg.filter((pl.col("min_fiat") <= buy_amount_rub) & (buy_amount_rub <= pl.col("max_fiat")))
-        leg = leg.filter(payment_filter_expr(rub_methods))
+        snap = leg_snapshot(state.data_dir, day, version, rub_leg)
 
-        if leg.is_empty():
+        if snap.is_empty():
             st.warning("No executable offers for current filters/amount.")
         else:
-            latest_ts = leg.select(pl.col("ts_utc").max()).item()
-            snap = leg.filter(pl.col("ts_utc") == latest_ts)
-            best = snap.sort("price_fiat_per_usdt").head(1)
-            st.metric("best_rub_per_usdt (single)", f"{best['price_fiat_per_usdt'][0]:.4f}")
+            latest_ts = snap["ts_utc"][0]
+            st.metric("best_rub_per_usdt (single)", f"{snap['price_fiat_per_usdt'][0]:.4f}")
             st.caption(f"snapshot ts_utc: {latest_ts}")
-            st.dataframe(snap.sort("price_fiat_per_usdt").head(20).to_pandas(), use_container_width=True)
+            st.dataframe(snap.to_pandas(), use_container_width=True)
 
     with col_sell:
         st.subheader("Sell USDT for VND (fiat=VND, side=BUY)")
-        leg = base.filter((pl.col("fiat") == "VND") & (pl.col("side") == "BUY"))
-        fiat_amount = sell_amount_usdt * pl.col("price_fiat_per_usdt")
-        leg = leg.filter((pl.col("min_fiat") <= fiat_amount) & (fiat_amount <= pl.col("max_fiat")))
-        leg = leg.filter(payment_filter_expr(vnd_methods))
+        snap = leg_snapshot(state.data_dir, day, version, vnd_leg)
 
-        if leg.is_empty():
+        if snap.is_empty():
             st.warning("No executable offers for current filters/amount.")
         else:
-            latest_ts = leg.select(pl.col("ts_utc").max()).item()
-            snap = leg.filter(pl.col("ts_utc") == latest_ts)
-            best = snap.sort("price_fiat_per_usdt", descending=True).head(1)
-            st.metric("best_vnd_per_usdt (single)", f"{best['price_fiat_per_usdt'][0]:.4f}")
+            latest_ts = snap["ts_utc"][0]
+            st.metric("best_vnd_per_usdt (single)", f"{snap['price_fiat_per_usdt'][0]:.4f}")
             st.caption(f"snapshot ts_utc: {latest_ts}")
-            st.dataframe(
-                snap.sort("price_fiat_per_usdt", descending=True).head(20).to_pandas(),
-                use_container_width=True,
-            )
+            st.dataframe(snap.to_pandas(), use_container_width=True)
 
     st.divider()
     st.subheader("History (best single per snapshot)")
 
     hist_cols = st.columns(2)
     with hist_cols[0]:
-        leg = base.filter((pl.col("fiat") == "RUB") & (pl.col("side") == "SELL"))
-        leg = leg.filter((pl.col("min_fiat") <= buy_amount_rub) & (buy_amount_rub <= pl.col("max_fiat")))
-        leg = leg.filter(payment_filter_expr(rub_methods))
-        if not leg.is_empty():
-            ts = (
-                leg.group_by("ts_utc")
-                .agg(pl.col("price_fiat_per_usdt").min().alias("best_rub_per_usdt"))
-                .sort("ts_utc")
-            )
+        ts = leg_history(state.data_dir, day, version, rub_leg, alias="best_rub_per_usdt")
+        if not ts.is_empty():
             st.line_chart(ts.to_pandas().set_index("ts_utc"))
 
     with hist_cols[1]:
-        leg = base.filter((pl.col("fiat") == "VND") & (pl.col("side") == "BUY"))
-        fiat_amount = sell_amount_usdt * pl.col("price_fiat_per_usdt")
-        leg = leg.filter((pl.col("min_fiat") <= fiat_amount) & (fiat_amount <= pl.col("max_fiat")))
-        leg = leg.filter(payment_filter_expr(vnd_methods))
-        if not leg.is_empty():
-            ts = (
-                leg.group_by("ts_utc")
-                .agg(pl.col("price_fiat_per_usdt").max().alias("best_vnd_per_usdt"))
-                .sort("ts_utc")
-            )
+        ts = leg_history(state.data_dir, day, version, vnd_leg, alias="best_vnd_per_usdt")
+        if not ts.is_empty():
             st.line_chart(ts.to_pandas().set_index("ts_utc"))
 
 
@@ -1,10 +1,19 @@
 from __future__ import annotations
 
+from collections.abc import Iterable
 from dataclasses import dataclass
 from typing import Literal, Optional
 
+import numpy as np
+import polars as pl
+
 from bitpeer.models import Offer
 
+try:
+    from numba import njit
+except ImportError:  # optional: `uv sync --extra fast`
+    njit = None
+
 
 @dataclass(frozen=True)
 class Constraints:
@@ -78,3 +87,229 @@ def best_single(
 
     return BestSingleResult(offer=best, price_fiat_per_usdt=best.price_fiat_per_usdt)
 
+
+@dataclass(frozen=True)
+class OfferArrays:
+    """
+    Struct-of-arrays view of a set of offers for vectorized selection.
+    Payment methods are a bitset per offer: `payment_mask[i, b // 64]` has bit `b % 64`
+    set if offer `i` accepts the method with `method_bits[...] == b`.
+    """
+
+    price: np.ndarray
+    min_fiat: np.ndarray
+    max_fiat: np.ndarray
+    is_sell: np.ndarray
+    is_merchant: np.ndarray
+    rating: np.ndarray  # NaN when unknown
+    payment_mask: np.ndarray
+    method_bits: dict[str, int]
+    # What the arrays were built from; a snapshot, later edits to it are not reflected.
+    source: pl.DataFrame | list[Offer]
+
+    @classmethod
+    def from_frame(cls, df: pl.DataFrame) -> OfferArrays:
+        cols = df.select(
+            pl.col("price_fiat_per_usdt").cast(pl.Float64),
+            pl.col("min_fiat").cast(pl.Float64),
+            pl.col("max_fiat").cast(pl.Float64),
+            (pl.col("side") == "SELL").alias("is_sell"),
+            pl.col("is_merchant").fill_null(False),
+            pl.col("rating").cast(pl.Float64).fill_null(float("nan")),
+        )
+        exploded = (
+            df.select(pl.int_range(pl.len(), dtype=pl.Int64).alias("row"), "payment_methods")
+            .explode("payment_methods")
+            .drop_nulls("payment_methods")
+        )
+        payment_mask, method_bits = _payment_masks(
+            df.height, exploded["row"].to_numpy(), exploded["payment_methods"].to_list()
+        )
+        return cls(
+            price=cols["price_fiat_per_usdt"].to_numpy(),
+            min_fiat=cols["min_fiat"].to_numpy(),
+            max_fiat=cols["max_fiat"].to_numpy(),
+            is_sell=cols["is_sell"].to_numpy(),
+            is_merchant=cols["is_merchant"].to_numpy(),
+            rating=cols["rating"].to_numpy(),
+            payment_mask=payment_mask,
+            method_bits=method_bits,
+            source=df,
+        )
+
+    @classmethod
+    def from_offers(cls, offers: list[Offer]) -> OfferArrays:
+        n = len(offers)
+        rows = [i for i, o in enumerate(offers) for _ in o.payment_methods]
+        methods = [m for o in offers for m in o.payment_methods]
+        payment_mask, method_bits = _payment_masks(n, np.array(rows, dtype=np.int64), methods)
+
+        def floats(values: Iterable[float]) -> np.ndarray:
+            return np.fromiter(values, dtype=np.float64, count=n)
+
+        def flags(values: Iterable[bool]) -> np.ndarray:
+            return np.fromiter(values, dtype=np.bool_, count=n)
+
+        nan = float("nan")
+        return cls(
+            price=floats(o.price_fiat_per_usdt for o in offers),
+            min_fiat=floats(o.min_fiat for o in offers),
+            max_fiat=floats(o.max_fiat for o in offers),
+            is_sell=flags(o.side == "SELL" for o in offers),
+            is_merchant=flags(o.is_merchant is True for o in offers),
+            rating=floats(o.rating if o.rating is not None else nan for o in offers),
+            payment_mask=payment_mask,
+            method_bits=method_bits,
+            source=list(offers),
+        )
+
+    def offer_at(self, i: int) -> Offer:
+        if isinstance(self.source, pl.DataFrame):
+            return Offer.model_validate(self.source.row(i, named=True))
+        return self.source[i]
+
+    def mask_for(self, methods: set[str]) -> np.ndarray:
+        # Methods no offer accepts have no bit and can never match.
+        mask = np.zeros(self.payment_mask.shape[1], dtype=np.uint64)
+        for m in methods:
+            b = self.method_bits.get(m)
+            if b is not None:
+                mask[b // 64] |= np.uint64(1) << np.uint64(b % 64)
+        return mask
+
+
+def _payment_masks(
+    n: int, rows: np.ndarray, methods: list[str]
+) -> tuple[np.ndarray, dict[str, int]]:
+    # `rows[k]` is the offer index that accepts `methods[k]`.
+    method_bits = {m: b for b, m in enumerate(dict.fromkeys(methods))}
+    words = max(1, -(-len(method_bits) // 64))
+    masks = np.zeros((n, words), dtype=np.uint64)
+    if methods:
+        codes = np.fromiter((method_bits[m] for m in methods), dtype=np.int64, count=len(methods))
+        bits = np.left_shift(np.uint64(1), (codes % 64).astype(np.uint64))
+        np.bitwise_or.at(masks, (rows, codes // 64), bits)
+    return masks, method_bits
+
+
+def _best_index_kernel(
+    price: np.ndarray,
+    min_fiat: np.ndarray,
+    max_fiat: np.ndarray,
+    is_sell: np.ndarray,
+    is_merchant: np.ndarray,
+    rating: np.ndarray,
+    payment_mask: np.ndarray,
+    buy_usdt: bool,
+    amount: float,
+    merchant_only: bool,
+    min_rating: float,
+    selected: np.ndarray,
+    check_payment: bool,
+) -> int:
+    # Single pass over the arrays; returns -1 if no offer qualifies.
+    best = -1
+    best_price = 0.0
+    words = payment_mask.shape[1]
+    for i in range(price.shape[0]):
+        if is_sell[i] != buy_usdt:
+            continue
+        amount_fiat = amount if buy_usdt else amount * price[i]
+        if amount_fiat < min_fiat[i] or amount_fiat > max_fiat[i]:
+            continue
+        if merchant_only and not is_merchant[i]:
+            continue
+        if rating[i] < min_rating:
+            continue
+        if check_payment:
+            hit = False
+            for w in range(words):
+                if payment_mask[i, w] & selected[w]:
+                    hit = True
+                    break
+            if not hit:
+                continue
+        p = price[i]
+        if best < 0 or (p < best_price if buy_usdt else p > best_price):
+            best = i
+            best_price = p
+    return best
+
+
+_best_index_jit = njit(cache=True)(_best_index_kernel) if njit is not None else None
+
+
+def _best_index(
+    arrays: OfferArrays,
+    *,
+    direction: Literal["buy_usdt", "sell_usdt"],
+    amount: float,
+    constraints: Constraints,
+) -> int | None:
+    if _best_index_jit is not None:
+        i = _best_index_jit(
+            arrays.price,
+            arrays.min_fiat,
+            arrays.max_fiat,
+            arrays.is_sell,
+            arrays.is_merchant,
+            arrays.rating,
+            arrays.payment_mask,
+            direction == "buy_usdt",
+            float(amount),
+            constraints.merchant_only,
+            float(constraints.min_rating),
+            arrays.mask_for(constraints.payment_methods_any or set()),
+            bool(constraints.payment_methods_any),
+        )
+        return i if i >= 0 else None
+
+    if direction == "buy_usdt":
+        ok = arrays.is_sell & (arrays.min_fiat <= amount) & (amount <= arrays.max_fiat)
+    else:
+        amount_fiat = amount * arrays.price
+        ok = ~arrays.is_sell & (arrays.min_fiat <= amount_fiat) & (amount_fiat <= arrays.max_fiat)
+
+    if constraints.merchant_only:
+        ok &= arrays.is_merchant
+    # NaN (unknown rating) compares False, so unrated offers pass like in `_passes_constraints`.
+    ok &= ~(arrays.rating < constraints.min_rating)
+    if constraints.payment_methods_any:
+        selected = arrays.mask_for(constraints.payment_methods_any)
+        ok &= (arrays.payment_mask & selected).any(axis=1)
+
+    idx = np.flatnonzero(ok)
+    if idx.size == 0:
+        return None
+    prices = arrays.price[idx]
+    # argmin/argmax keep the first of equal prices, same as min()/max() in `best_single`.
+    pos = prices.argmin() if direction == "buy_usdt" else prices.argmax()
+    return int(idx[pos])
+
+
+def best_single_vec(
+    offers: OfferArrays | pl.DataFrame | list[Offer],
+    *,
+    direction: Literal["buy_usdt", "sell_usdt"],
+    amount: float,
+    constraints: Constraints,
+) -> BestSingleResult | None:
+    """
+    Same result as `best_single`, computed over an `OfferArrays` view (with the numba
+    kernel when installed). A frame or list is converted on every call; to run several
+    queries over the same offers, build `OfferArrays` once and pass it in.
+    """
+
+    if isinstance(offers, OfferArrays):
+        arrays = offers
+    elif isinstance(offers, pl.DataFrame):
+        arrays = OfferArrays.from_frame(offers)
+    else:
+        arrays = OfferArrays.from_offers(offers)
+
+    i = _best_index(arrays, direction=direction, amount=amount, constraints=constraints)
+    if i is None:
+        return None
+
+    best = arrays.offer_at(i)
+    return BestSingleResult(offer=best, price_fiat_per_usdt=best.price_fiat_per_usdt)
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+import hashlib
 from datetime import datetime
 from typing import Any, Literal, Optional
 
+import msgspec
 from pydantic import BaseModel, Field
 
 
@@ -25,7 +27,17 @@ class Offer(BaseModel):
     page: Optional[int] = None
 
 
-class RawFetchRecord(BaseModel):
+def response_body_hash(text: str) -> str:
+    """
+    Short content hash of a response body, used to spot byte-identical snapshots.
+    """
+
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+class RawFetchRecord(msgspec.Struct, kw_only=True):
+    # A msgspec Struct rather than a Pydantic model: records are only ever written and
+    # read back by this package, so decoding them needs no validation layer.
     format_version: Literal["rawfetch-v1"] = "rawfetch-v1"
     ts_utc: datetime
 
@@ -36,10 +48,11 @@ class RawFetchRecord(BaseModel):
 
     request_url: str
     request_method: Literal["GET", "POST"]
-    request_headers: dict[str, str] = Field(default_factory=dict)
-    request_body: dict[str, Any] = Field(default_factory=dict)
+    request_headers: dict[str, str] = msgspec.field(default_factory=dict)
+    request_body: dict[str, Any] = msgspec.field(default_factory=dict)
 
     http_status: Optional[int] = None
     response_text: Optional[str] = None
+    # `response_body_hash(response_text)`; absent in records written before it was added.
+    body_hash: str | None = None
     error: Optional[str] = None
-
@@ -1,34 +1,158 @@
 from __future__ import annotations
 
-import gzip
-import json
 import logging
+import zlib
 from pathlib import Path
-from typing import Any, Iterable, Optional
+from typing import Any, Iterable, Iterator, Optional
 
+import msgspec
+import orjson
 import polars as pl
+import pyarrow.parquet as pq
+import zstandard
 
 from bitpeer.common.config import AppConfig
-from bitpeer.models import Offer, RawFetchRecord
+from bitpeer.models import RawFetchRecord, response_body_hash
 
 log = logging.getLogger(__name__)
 
+_RAW_DECODER = msgspec.json.Decoder(RawFetchRecord)
+
+# Column layout of the processed offers parquet; mirrors the fields of `Offer`.
+_OFFERS_SCHEMA: dict[str, pl.DataType] = {
+    "ts_utc": pl.Datetime(time_unit="us", time_zone="UTC"),
+    "asset": pl.Utf8,
+    "fiat": pl.Utf8,
+    "side": pl.Utf8,
+    "price_fiat_per_usdt": pl.Float64,
+    "min_fiat": pl.Float64,
+    "max_fiat": pl.Float64,
+    "payment_methods": pl.List(pl.Utf8),
+    "is_merchant": pl.Boolean,
+    "rating": pl.Float64,
+    "advertiser_key": pl.Utf8,
+    "market": pl.Utf8,
+    "page": pl.Int64,
+}
+
+OfferColumns = dict[str, list[Any]]
+
+# Large row groups keep the dashboard's predicate/projection pushdown effective.
+_ROW_GROUP_SIZE = 65_536
+
+
+def _empty_columns() -> OfferColumns:
+    return {name: [] for name in _OFFERS_SCHEMA}
+
+
+_READ_CHUNK = 64 * 1024
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _split_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        yield from lines
+    # A truncated trailing record (e.g. collector killed mid-write) surfaces here as
+    # a partial line and is reported by the caller like any other bad line.
+    if pending:
+        yield pending
+
+
+def _gzip_chunks(path: Path) -> Iterator[bytes]:
+    """
+    Decompress a gzip file in 64KB input chunks with zlib. `RawStore` used to append
+    one gzip member per record, so a new decompressor is started whenever one ends.
+    """
+
+    decomp = zlib.decompressobj(wbits=31)
+    with path.open("rb") as f:
+        while chunk := f.read(_READ_CHUNK):
+            while chunk:
+                yield decomp.decompress(chunk)
+                if not decomp.eof:
+                    break
+                chunk = decomp.unused_data
+                decomp = zlib.decompressobj(wbits=31)
+
+
+def _zstd_chunks(path: Path) -> Iterator[bytes]:
+    """
+    Decompress a zstd file frame by frame. `RawStore` appends one frame per record, so a
+    collector killed mid-write leaves a torn frame that later appends bury mid-file.
+    On a decode error, skip to the next frame's magic number and carry on.
+    """
+
+    dctx = zstandard.ZstdDecompressor()
+    decomp: zstandard.ZstdDecompressionObj | None = None  # None: looking for a frame
+    frame = b""  # input fed to the current frame, to resync from if it turns out torn
+    buf = b""
+    with path.open("rb") as f:
+        while True:
+            chunk = f.read(_READ_CHUNK)
+            buf += chunk
+            while buf:
+                if decomp is None:
+                    start = buf.find(_ZSTD_MAGIC)
+                    if start < 0:
+                        # Keep a tail in case the magic number straddles two reads.
+                        buf = buf[-(len(_ZSTD_MAGIC) - 1) :]
+                        break
+                    buf = buf[start:]
+                    decomp = dctx.decompressobj()
+                    frame = b""
+
+                data, buf = buf, b""
+                try:
+                    out = decomp.decompress(data)
+                except zstandard.ZstdError as e:
+                    log.warning("corrupt zstd frame file=%s error=%s", path, repr(e))
+                    # End the torn record's partial line so it cannot swallow the next one.
+                    yield b"\n"
+                    buf = (frame + data)[1:]
+                    decomp = None
+                    continue
+
+                frame += data
+                if out:
+                    yield out
+                if decomp.eof:
+                    buf = decomp.unused_data
+                    decomp = None
+
+            if chunk:
+                continue
+            if decomp is None:
+                break
+            # The file ended inside a frame. It is torn: either the trailing record, or one
+            # whose missing bytes were filled by later frames without tripping an error.
+            log.warning("truncated zstd frame file=%s", path)
+            yield b"\n"
+            buf = frame[1:]
+            decomp = None
+
 
 def iter_raw_records(data_dir: Path, *, day: str) -> Iterable[RawFetchRecord]:
     raw_dir = data_dir / "raw" / day
     if not raw_dir.exists():
         return
 
-    for path in sorted(raw_dir.glob("*.jsonl.gz")):
-        with gzip.open(path, "rt", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    yield RawFetchRecord.model_validate_json(line)
-                except Exception as e:  # noqa: BLE001
-                    log.warning("bad raw line file=%s error=%s", path, repr(e))
+    # `.jsonl.gz` files predate the switch to zstd; for a market that has both on the
+    # same day, the sort puts the older gzip file first.
+    paths = sorted([*raw_dir.glob("*.jsonl.gz"), *raw_dir.glob("*.jsonl.zst")])
+    for path in paths:
+        chunks = _zstd_chunks(path) if path.suffix == ".zst" else _gzip_chunks(path)
+        # Raw bytes straight into msgspec: no text wrapper, no separate utf-8 decode pass.
+        for line in _split_lines(chunks):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield _RAW_DECODER.decode(line)
+            except Exception as e:  # noqa: BLE001
+                log.warning("bad raw line file=%s error=%s", path, repr(e))
 
 
 def _to_float(value: Any) -> Optional[float]:
@@ -44,13 +168,6 @@ def _to_float(value: Any) -> Optional[float]:
     return None
 
 
-def _first_present(d: dict[str, Any], keys: list[str]) -> Any:
-    for k in keys:
-        if k in d:
-            return d[k]
-    return None
-
-
 def _maybe_dict(value: Any) -> Optional[dict[str, Any]]:
     return value if isinstance(value, dict) else None
 
@@ -67,6 +184,40 @@ _MERCHANT_KEYS = ["isMerchant", "merchant", "is_merchant"]
 _RATING_KEYS = ["rating", "userRating", "user_rating", "score"]
 _ADVERTISER_KEYS = ["userId", "uid", "advertiserId", "advertiser_id", "nickName", "nickname"]
 
+_FIELD_KEYS: dict[str, list[str]] = {
+    "price": _PRICE_KEYS,
+    "min": _MIN_KEYS,
+    "max": _MAX_KEYS,
+    "payment": _PAYMENT_KEYS,
+    "merchant": _MERCHANT_KEYS,
+    "rating": _RATING_KEYS,
+    "advertiser": _ADVERTISER_KEYS,
+}
+
+# key -> (field, priority of the key within that field's list; lower wins)
+_KEY_ROUTE: dict[str, tuple[str, int]] = {
+    k: (field, rank) for field, keys in _FIELD_KEYS.items() for rank, k in enumerate(keys)
+}
+
+
+def _route_fields(d: dict[str, Any]) -> dict[str, Any]:
+    """
+    One pass over `d`, sorting its values into the `_FIELD_KEYS` slots.
+    If several aliases of a field are present, the one listed first wins.
+    """
+
+    slots: dict[str, Any] = {}
+    ranks: dict[str, int] = {}
+    for k, v in d.items():
+        route = _KEY_ROUTE.get(k)
+        if route is None:
+            continue
+        field, rank = route
+        if field not in ranks or rank < ranks[field]:
+            slots[field] = v
+            ranks[field] = rank
+    return slots
+
 
 def _extract_offer_items(payload: Any) -> list[dict[str, Any]]:
     """
@@ -117,8 +268,7 @@ def _extract_offer_items(payload: Any) -> list[dict[str, Any]]:
     return found or []
 
 
-def _extract_payment_methods(item: dict[str, Any]) -> list[str]:
-    raw = _first_present(item, _PAYMENT_KEYS)
+def _extract_payment_methods(raw: Any) -> list[str]:
     methods: list[str] = []
 
     if isinstance(raw, list):
@@ -148,92 +298,123 @@ def _extract_payment_methods(item: dict[str, Any]) -> list[str]:
     return out
 
 
-def parse_raw_fetch(record: RawFetchRecord) -> list[Offer]:
+def parse_raw_fetch(record: RawFetchRecord) -> OfferColumns:
+    """
+    Parse one raw page into offer columns (see `_OFFERS_SCHEMA`), one list entry per offer.
+    """
+
+    columns = _empty_columns()
     if not record.response_text:
-        return []
+        return columns
 
     try:
-        payload = json.loads(record.response_text)
+        payload = orjson.loads(record.response_text)
     except Exception:  # noqa: BLE001
-        return []
+        return columns
 
     items = _extract_offer_items(payload)
-    offers: list[Offer] = []
+
+    prices = columns["price_fiat_per_usdt"]
+    min_fiats = columns["min_fiat"]
+    max_fiats = columns["max_fiat"]
+    payment_methods = columns["payment_methods"]
+    is_merchants = columns["is_merchant"]
+    ratings = columns["rating"]
+    advertiser_keys = columns["advertiser_key"]
 
     for item in items:
         adv = _maybe_dict(item.get("adv")) or _maybe_dict(item.get("advertisement")) or {}
         advertiser = _maybe_dict(item.get("advertiser")) or _maybe_dict(item.get("user")) or {}
 
-        price = _to_float(_first_present(adv, _PRICE_KEYS) or _first_present(item, _PRICE_KEYS))
-        min_fiat = _to_float(_first_present(adv, _MIN_KEYS) or _first_present(item, _MIN_KEYS))
-        max_fiat = _to_float(_first_present(adv, _MAX_KEYS) or _first_present(item, _MAX_KEYS))
+        item_f = _route_fields(item)
+        adv_f = _route_fields(adv) if adv else {}
+        advertiser_f = _route_fields(advertiser) if advertiser else {}
+
+        price = _to_float(adv_f.get("price") or item_f.get("price"))
+        min_fiat = _to_float(adv_f.get("min") or item_f.get("min"))
+        max_fiat = _to_float(adv_f.get("max") or item_f.get("max"))
         if price is None or min_fiat is None or max_fiat is None:
             continue
 
-        is_merchant_raw = _first_present(advertiser, _MERCHANT_KEYS) or _first_present(item, _MERCHANT_KEYS)
+        is_merchant_raw = advertiser_f.get("merchant") or item_f.get("merchant")
         is_merchant = bool(is_merchant_raw) if is_merchant_raw is not None else None
 
-        rating_raw = _first_present(advertiser, _RATING_KEYS) or _first_present(item, _RATING_KEYS)
+        rating_raw = advertiser_f.get("rating") or item_f.get("rating")
         rating = _to_float(rating_raw)
 
-        advertiser_key_raw = (
-            _first_present(advertiser, _ADVERTISER_KEYS) or _first_present(item, _ADVERTISER_KEYS)
-        )
+        advertiser_key_raw = advertiser_f.get("advertiser") or item_f.get("advertiser")
         advertiser_key = str(advertiser_key_raw) if advertiser_key_raw is not None else None
 
-        offers.append(
-            Offer(
-                ts_utc=record.ts_utc,
-                fiat=record.fiat,
-                side=record.side,
-                price_fiat_per_usdt=price,
-                min_fiat=min_fiat,
-                max_fiat=max_fiat,
-                payment_methods=_extract_payment_methods(item),
-                is_merchant=is_merchant,
-                rating=rating,
-                advertiser_key=advertiser_key,
-                market=record.market,
-                page=record.page,
-            )
-        )
-
-    return offers
+        prices.append(price)
+        min_fiats.append(min_fiat)
+        max_fiats.append(max_fiat)
+        payment_methods.append(_extract_payment_methods(item_f.get("payment")))
+        is_merchants.append(is_merchant)
+        ratings.append(rating)
+        advertiser_keys.append(advertiser_key)
+
+    # Per-record values are the same for every offer on the page.
+    n = len(prices)
+    columns["ts_utc"] = [record.ts_utc] * n
+    columns["asset"] = ["USDT"] * n
+    columns["fiat"] = [record.fiat] * n
+    columns["side"] = [record.side] * n
+    columns["market"] = [record.market] * n
+    columns["page"] = [record.page] * n
+    return columns
+
+
+def _parse_or_reuse(
+    record: RawFetchRecord, last_parsed: dict[tuple[str, int], tuple[str, OfferColumns]]
+) -> OfferColumns:
+    if not record.response_text:
+        return parse_raw_fetch(record)
 
+    body_hash = record.body_hash or response_body_hash(record.response_text)
+    key = (record.market, record.page)
+    cached = last_parsed.get(key)
+    if cached is not None and cached[0] == body_hash:
+        chunk = cached[1]
+        return {**chunk, "ts_utc": [record.ts_utc] * len(chunk["ts_utc"])}
 
-def process_day(cfg: AppConfig, *, day: str) -> Path:
-    data_dir = Path(cfg.app.data_dir)
-    offers: list[dict[str, Any]] = []
+    chunk = parse_raw_fetch(record)
+    last_parsed[key] = (body_hash, chunk)
+    return chunk
+
+
+def _write_row_group(writer: pq.ParquetWriter, columns: OfferColumns) -> None:
+    # One row group per flush: a flush can overshoot `_ROW_GROUP_SIZE` by one record's
+    # offers, and splitting at the limit would leave a tiny trailing group behind.
+    table = pl.DataFrame(columns, schema=_OFFERS_SCHEMA).to_arrow()
+    writer.write_table(table, row_group_size=table.num_rows)
 
-    for record in iter_raw_records(data_dir, day=day):
-        for offer in parse_raw_fetch(record):
-            offers.append(offer.model_dump())
 
+def process_day(cfg: AppConfig, *, day: str) -> Path:
+    data_dir = Path(cfg.app.data_dir)
     out_dir = data_dir / "processed" / "offers"
     out_dir.mkdir(parents=True, exist_ok=True)
     out_path = out_dir / f"{day}.parquet"
-
-    if not offers:
-        # Write an empty file with a minimal schema for downstream code.
-        df = pl.DataFrame(
-            schema={
-                "ts_utc": pl.Datetime(time_unit="us", time_zone="UTC"),
-                "asset": pl.Utf8,
-                "fiat": pl.Utf8,
-                "side": pl.Utf8,
-                "price_fiat_per_usdt": pl.Float64,
-                "min_fiat": pl.Float64,
-                "max_fiat": pl.Float64,
-                "payment_methods": pl.List(pl.Utf8),
-                "is_merchant": pl.Boolean,
-                "rating": pl.Float64,
-                "advertiser_key": pl.Utf8,
-                "market": pl.Utf8,
-                "page": pl.Int64,
-            }
-        )
-    else:
-        df = pl.DataFrame(offers)
-
-    df.write_parquet(out_path)
+    # Written next to the target and renamed at the end, so readers never see a partial file.
+    tmp_path = out_path.with_name(f"{out_path.name}.tmp")
+
+    columns = _empty_columns()
+    # Last parsed body per (market, page). Consecutive snapshots often return the same
+    # bytes; on a repeat only the timestamp column changes.
+    last_parsed: dict[tuple[str, int], tuple[str, OfferColumns]] = {}
+
+    # Offers are flushed one row group at a time, so memory stays bounded by the row
+    # group size rather than the whole day. An empty day still gets the full schema.
+    schema = pl.DataFrame(schema=_OFFERS_SCHEMA).to_arrow().schema
+    with pq.ParquetWriter(tmp_path, schema, compression="zstd", compression_level=3) as writer:
+        for record in iter_raw_records(data_dir, day=day):
+            chunk = _parse_or_reuse(record, last_parsed)
+            for name, values in columns.items():
+                values.extend(chunk[name])
+            if len(columns["ts_utc"]) >= _ROW_GROUP_SIZE:
+                _write_row_group(writer, columns)
+                columns = _empty_columns()
+        if columns["ts_utc"]:
+            _write_row_group(writer, columns)
+
+    tmp_path.replace(out_path)
     return out_path
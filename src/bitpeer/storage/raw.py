@@ -1,11 +1,15 @@
 from __future__ import annotations
 
-import gzip
-import json
 from pathlib import Path
 
+import msgspec
+import zstandard
+
 from bitpeer.models import RawFetchRecord
 
+_ENCODER = msgspec.json.Encoder()
+_COMPRESSOR = zstandard.ZstdCompressor(level=3, write_checksum=True)
+
 
 class RawStore:
     def __init__(self, data_dir: Path) -> None:
@@ -13,14 +17,14 @@ class RawStore:
 
     def append(self, record: RawFetchRecord) -> Path:
         day = record.ts_utc.date().isoformat()
-        out_path = self._data_dir / "raw" / day / f"{record.market}.jsonl.gz"
+        out_path = self._data_dir / "raw" / day / f"{record.market}.jsonl.zst"
         out_path.parent.mkdir(parents=True, exist_ok=True)
 
-        payload = record.model_dump(mode="json")
-        line = json.dumps(payload, ensure_ascii=False)
-        with gzip.open(out_path, "at", encoding="utf-8") as f:
-            f.write(line)
-            f.write("\n")
+        # One self-contained zstd frame per record: appends never touch earlier data,
+        # and readers decode the concatenated frames as a single stream.
+        frame = _COMPRESSOR.compress(_ENCODER.encode(record) + b"\n")
+        with out_path.open("ab") as f:
+            f.write(frame)
 
         return out_path
 